@@ -2,15 +2,29 @@
 Common utilities for the runwith package.
 """
 
-import random
-import string
+import hashlib
+import io
+import mmap
+import os
+import pickle
+import re
+import shlex
+import tempfile
+import threading
+import weakref
 from dataclasses import dataclass, field
-from functools import partial
+from contextlib import contextmanager
+from functools import cached_property
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
-from typing import Any, Callable
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Literal, Optional, Union
 
 import cloudpickle
-import sh
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 EXEC_TEMPLATE = """#!/bin/bash
 python {target}
@@ -18,20 +32,150 @@ python {target}
 """
 
 
-TARGET_TEMPLATE = """import sys
+RETURN_ENCODER = """import json
+import math
+
+try:
+    import orjson
+
+    json_dumps = orjson.dumps
+except ImportError:
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+
+
+def is_json(obj):
+    if obj is None or type(obj) in (bool, int, str):
+        return True
+    if type(obj) is float:
+        return math.isfinite(obj)
+    if type(obj) is list:
+        return all(is_json(item) for item in obj)
+    if type(obj) is dict:
+        return all(type(key) is str and is_json(value) for key, value in obj.items())
+    return False
+
+
+def encode_json(obj):
+    try:
+        return json_dumps(obj) if is_json(obj) else None
+    except (TypeError, ValueError, RecursionError):
+        return None
+
+"""
+
+
+TARGET_TEMPLATE = RETURN_ENCODER + """import io
+import itertools
+import mmap
+import os
 import pickle
 from pathlib import Path
 
-with open("{pickle_path}", "rb") as f:
-    func = pickle.load(f)
-    ret = func()
-    ret_path = Path("{ret_path}")
-    with open(ret_path, "wb") as f:
-        pickle.dump(ret, f)
+
+def load_buffer(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return bytearray()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+def load_buffers(path):
+    buffers = []
+    for i in itertools.count():
+        buf_path = path.with_suffix(f".buf{{i}}.bin")
+        if not buf_path.exists():
+            return buffers
+        buffers.append(load_buffer(buf_path))
+
+
+def decompress(f):
+    magic = f.peek(4)[:4]
+    if magic == bytes.fromhex("28b52ffd"):
+        import zstandard
+
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(f, closefd=False), 1 << 20
+        )
+    if magic == bytes.fromhex("04224d18"):
+        import lz4.frame
+
+        return lz4.frame.LZ4FrameFile(f)
+    return f
+
+
+func_path = Path("{func_path}")
+with open(func_path, "rb", buffering=1 << 20) as f:
+    func = pickle.load(decompress(f), buffers=load_buffers(func_path))
+
+pickle_path = Path("{pickle_path}")
+with open(pickle_path, "rb", buffering=1 << 20) as f:
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    buffers = load_buffers(pickle_path)
+    args, kwargs = pickle.load(decompress(f), buffers=buffers)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+ret = func(*args, **kwargs)
+
+ret_path = Path("{ret_path}")
+buffer_ids = itertools.count()
+
+
+def dump_buffer(buf):
+    ret_path.with_suffix(f".buf{{next(buffer_ids)}}.bin").write_bytes(buf.raw())
+
+
+data = encode_json(ret)
+with open(ret_path, "wb", buffering=1 << 20) as f:
+    if data is None:
+        f.write(b"P")
+        pickle.dump(ret, f, protocol=5, buffer_callback=dump_buffer)
+    else:
+        f.write(b"J")
+        f.write(data)
 
 """
 
 
+SHM_TARGET_TEMPLATE = RETURN_ENCODER + """import os
+import pickle
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+
+shm = SharedMemory(name=os.environ["RUNWITH_SHM"])
+resource_tracker.unregister(shm._name, "shared_memory")
+func, args, kwargs = pickle.loads(shm.buf)
+shm.close()
+ret = func(*args, **kwargs)
+
+data = encode_json(ret)
+tag = b"P" if data is None else b"J"
+if data is None:
+    data = pickle.dumps(ret, protocol=5)
+out = SharedMemory(create=True, size=len(data) + 1)
+resource_tracker.unregister(out._name, "shared_memory")
+out.buf[:1] = tag
+out.buf[1 : len(data) + 1] = data
+out.close()
+Path("{ret_path}").write_text(f"{{out.name}} {{len(data) + 1}}")
+
+"""
+
+Transport = Literal["file", "shm"]
+
+Compression = Literal["none", "zstd", "lz4"]
+
+COMPRESSION_THRESHOLD = 64 * 1024
+
+# Linux limits a single command line argument to 128 KiB.
+MAX_INLINE_TARGET = 64 * 1024
+
+PLAIN_TARGET_LINE = re.compile(r"[ \t]*(exec[ \t]+)?(\S*/)?python[\d.]*[ \t]+\{target\}[ \t]*")
+
+
 @dataclass
 class Assets:
     """
@@ -39,33 +183,543 @@ class Assets:
     """
 
     base: Path
-    target: Path = field(init=False)
-    dump: Path = field(init=False)
-    ret: Path = field(init=False)
-    exec: Path = field(init=False)
-    log: Path = field(init=False)
+    transport: Transport = "file"
+    buffers: list[Path] = field(init=False, default_factory=list)
+    shm: Optional[SharedMemory] = field(init=False, default=None)
+    func: Optional[Path] = field(init=False, default=None)
 
     def __post_init__(self):
+        self.base = self.base.absolute()
         self.base.parent.mkdir(parents=True, exist_ok=True)
-        self.target = self.base.with_suffix(".target.py").absolute()
-        self.dump = self.base.with_suffix(".dump.pickle").absolute()
-        self.ret = self.base.with_suffix(".ret.pickle").absolute()
-        self.exec = self.base.with_suffix(".sh").absolute()
-        self.log = self.base.with_suffix(".log").absolute()
 
-        for path in [self.target, self.dump, self.ret, self.exec, self.log]:
-            if path.exists():
-                path.touch()
+    @cached_property
+    def target(self) -> Path:
+        """Path to the target script, if it is not embedded in the shell script."""
+        return self.base.with_suffix(".target.py")
+
+    @cached_property
+    def dump(self) -> Path:
+        """Path to the pickled function."""
+        return self.base.with_suffix(".dump.pickle")
+
+    @cached_property
+    def ret(self) -> Path:
+        """Path to the pickled return value."""
+        return self.base.with_suffix(".ret.pickle")
+
+    @cached_property
+    def exec(self) -> Path:
+        """Path to the executable shell script."""
+        return self.base.with_suffix(".sh")
+
+    @cached_property
+    def log(self) -> Path:
+        """Path to the log file."""
+        return self.base.with_suffix(".log")
 
     def cleanup(self):
         """
         Remove all the generated files.
         """
         for path in [self.target, self.dump, self.ret, self.exec, self.log]:
-            if path.exists():
-                path.unlink()
-        if self.target.parent.exists():
-            self.target.parent.rmdir()
+            path.unlink(missing_ok=True)
+        # Buffers are found on disk, as dumping may have failed before all were listed.
+        for path in buffer_paths(self.dump) + buffer_paths(self.ret):
+            path.unlink()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        if self.func is not None:
+            release_func(self.func)
+            self.func = None
+        if self.base.parent.exists():
+            self.base.parent.rmdir()
+
+
+def make_dir() -> Path:
+    """
+    Create a uniquely named directory for generated files in the working directory.
+
+    The working directory rather than the system temp directory is used so that
+    the files stay visible to jobs running on other nodes of a shared filesystem.
+
+    Returns:
+        Path: absolute path to the new directory
+    """
+    return Path(tempfile.mkdtemp(prefix="runwith_", dir=Path.cwd()))
+
+
+def buffer_paths(path: Path) -> list[Path]:
+    """
+    Find the out-of-band buffer files written next to a pickle file.
+
+    Args:
+        path (Path): path to the pickle file
+
+    Returns:
+        list[Path]: existing buffer files, in pickling order
+    """
+    paths = []
+    while (buf_path := path.with_suffix(f".buf{len(paths)}.bin")).exists():
+        paths.append(buf_path)
+    return paths
+
+
+def load_buffer(path: Path) -> Union[mmap.mmap, bytearray]:
+    """
+    Map an out-of-band buffer file into memory without copying it.
+
+    The mapping is copy-on-write, so objects rebuilt on top of it stay writable.
+
+    Args:
+        path (Path): path to the buffer file
+
+    Returns:
+        Union[mmap.mmap, bytearray]: buffer backed by the file
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return bytearray()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+class MainGuard:
+    """
+    Writable wrapper rejecting pickle streams that reference ``__main__``.
+    """
+
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+
+    def write(self, data: bytes) -> int:
+        """
+        Write a chunk of the pickle stream to the wrapped file.
+
+        Args:
+            data (bytes): chunk of the pickle stream
+
+        Raises:
+            pickle.PicklingError: if the chunk references ``__main__``
+
+        Returns:
+            int: number of bytes written
+        """
+        if isinstance(data, bytes) and b"__main__" in data:
+            raise pickle.PicklingError("object references __main__")
+        return self.file.write(data)
+
+
+def drop_cache(file: BinaryIO) -> None:
+    """
+    Advise the kernel to drop a consumed file from the page cache.
+
+    The generated files are read exactly once and then deleted, so keeping them
+    cached would only evict pages of other workloads. Pages still mapped into
+    memory are left alone by the kernel. This is a no-op where
+    ``os.posix_fadvise`` is unavailable.
+
+    Args:
+        file (BinaryIO): the consumed file
+    """
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+class CompressingWriter:
+    """
+    Writable compressing a stream once it grows past ``COMPRESSION_THRESHOLD``.
+
+    Smaller streams are written as is, since compressing them gains nothing. The
+    target tells both apart by the zstd/lz4 frame magic number.
+    """
+
+    def __init__(self, file: BinaryIO, compression: Compression) -> None:
+        self.file = file
+        self.compression = compression
+        self.spool = bytearray()
+        self.compressor: Any = None
+
+    def write(self, data: bytes) -> int:
+        """
+        Write a chunk of the stream.
+
+        Args:
+            data (bytes): chunk of the stream
+
+        Returns:
+            int: number of bytes consumed
+        """
+        if self.compressor is not None:
+            self.file.write(self.compressor.compress(data))
+            return len(data)
+        self.spool += data
+        if len(self.spool) > COMPRESSION_THRESHOLD:
+            if self.compression == "zstd":
+                import zstandard
+
+                self.compressor = zstandard.ZstdCompressor(level=3).compressobj()
+            else:
+                import lz4.frame
+
+                self.compressor = lz4.frame.LZ4FrameCompressor()
+                self.file.write(self.compressor.begin())
+            self.file.write(self.compressor.compress(self.spool))
+            self.spool = bytearray()
+        return len(data)
+
+    def finish(self) -> None:
+        """
+        Write out the end of the stream.
+        """
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
+        else:
+            self.file.write(self.spool)
+
+
+@contextmanager
+def compressing(file: BinaryIO, compression: Compression) -> Iterator[Any]:
+    """
+    Compress what is written in the context into a file.
+
+    The end of the stream is only written if the context exits without error.
+
+    Args:
+        file (BinaryIO): file to write the compressed stream to
+        compression (Compression): "none", "zstd" or "lz4"
+
+    Yields:
+        Any: writable to write the uncompressed stream to
+    """
+    if compression == "none":
+        yield file
+        return
+    writer = CompressingWriter(file, compression)
+    yield writer
+    writer.finish()
+
+
+def dump(
+    obj: Any,
+    file: BinaryIO,
+    buffer_callback: Optional[Callable[[pickle.PickleBuffer], Any]] = None,
+    compression: Compression = "none",
+) -> bool:
+    """
+    Pickle an object into a file with protocol 5, preferring the C pickler over cloudpickle.
+
+    The stdlib pickler is used whenever it can pickle the object by reference. Objects
+    it cannot handle (lambdas, closures, ...) and objects referring to ``__main__``,
+    which does not exist under that name on the target, fall back to cloudpickle.
+    So does everything while a module is registered with
+    ``cloudpickle.register_pickle_by_value``.
+    Both produce streams that ``pickle.load`` on the target understands.
+
+    Args:
+        obj (Any): object to be pickled.
+        file (BinaryIO): seekable file to write the pickle stream to.
+        buffer_callback (Callable, optional): receives out-of-band buffers, as in
+                ``pickle.dump``. Defaults to None, which keeps buffers in-band.
+        compression (Compression, optional): compression of the pickle stream, applied
+                when it exceeds ``COMPRESSION_THRESHOLD``. Defaults to "none".
+
+    Returns:
+        bool: True if the stdlib pickler was used, False if it fell back to cloudpickle.
+    """
+    # Modules registered with cloudpickle.register_pickle_by_value are usually not
+    # installed on the target, but the stdlib pickler would refer to them by name.
+    if not cloudpickle.list_registry_pickle_by_value():
+        buffers: list[pickle.PickleBuffer] = []
+        start = file.tell()
+        try:
+            with compressing(file, compression) as f:
+                pickle.dump(
+                    obj,
+                    MainGuard(f),
+                    protocol=5,
+                    buffer_callback=None if buffer_callback is None else buffers.append,
+                )
+        except (pickle.PicklingError, AttributeError, TypeError):
+            file.seek(start)
+            file.truncate()
+        else:
+            if buffer_callback is not None:
+                for buf in buffers:
+                    buffer_callback(buf)
+            return True
+    with compressing(file, compression) as f:
+        cloudpickle.dump(obj, f, protocol=5, buffer_callback=buffer_callback)
+    return False
+
+
+def dumps(
+    obj: Any, buffer_callback: Optional[Callable[[pickle.PickleBuffer], Any]] = None
+) -> bytes:
+    """
+    Pickle an object with protocol 5, see ``dump``.
+
+    Args:
+        obj (Any): object to be pickled.
+        buffer_callback (Callable, optional): receives out-of-band buffers, as in
+                ``pickle.dumps``. Defaults to None, which keeps buffers in-band.
+
+    Returns:
+        bytes: pickle stream.
+    """
+    with io.BytesIO() as f:
+        dump(obj, f, buffer_callback)
+        return f.getvalue()
+
+
+def dump_pickle(obj: Any, path: Path, compression: Compression = "none") -> list[Path]:
+    """
+    Stream an object into a pickle file with protocol 5, writing large buffers out-of-band.
+
+    Buffers exposed through ``PickleBuffer`` (e.g. NumPy arrays) are written raw to
+    ``<path>.bufN.bin`` side files instead of being copied into the pickle stream.
+    They are never compressed so that the target can map them without copies.
+
+    Args:
+        obj (Any): object to be pickled.
+        path (Path): path to the pickle file.
+        compression (Compression, optional): compression of the pickle stream.
+                Defaults to "none".
+
+    Returns:
+        list[Path]: paths to the out-of-band buffer files, in pickling order.
+    """
+    paths: list[Path] = []
+
+    def dump_buffer(buf: pickle.PickleBuffer) -> None:
+        buf_path = path.with_suffix(f".buf{len(paths)}.bin")
+        buf_path.write_bytes(buf.raw())
+        paths.append(buf_path)
+
+    with open(path, "wb", buffering=1 << 20) as f:
+        dump(obj, f, buffer_callback=dump_buffer, compression=compression)
+    return paths
+
+
+class HashingWriter:
+    """
+    Writable hashing a stream with blake2b without storing it.
+
+    Rewinding it, as ``dump`` does before falling back to cloudpickle, restarts the
+    digest.
+    """
+
+    def __init__(self, person: bytes = b"") -> None:
+        self.person = person
+        self.digest = hashlib.blake2b(digest_size=16, person=person)
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        """
+        Hash a chunk of the stream.
+
+        Args:
+            data (bytes): chunk of the stream
+
+        Returns:
+            int: number of bytes consumed
+        """
+        self.digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        """
+        Get the number of bytes hashed.
+
+        Returns:
+            int: current position
+        """
+        return self.size
+
+    def seek(self, offset: int) -> int:
+        """
+        Rewind to the start, forgetting what was hashed.
+
+        Args:
+            offset (int): new position, must be 0
+
+        Returns:
+            int: new position
+        """
+        if offset != 0:
+            raise io.UnsupportedOperation("can only rewind to the start")
+        self.digest = hashlib.blake2b(digest_size=16, person=self.person)
+        self.size = 0
+        return 0
+
+    def truncate(self) -> int:
+        """
+        Do nothing, as nothing is stored.
+
+        Returns:
+            int: current position
+        """
+        return self.size
+
+
+FUNC_CACHE: "weakref.WeakKeyDictionary[Callable, tuple[Path, list[Path]]]" = (
+    weakref.WeakKeyDictionary()
+)
+FUNC_CACHE_LOCK = threading.Lock()
+STORE_DIRS: dict[int, Path] = {}
+STORE_REFS: dict[Path, int] = {}
+
+
+def store_dir() -> Path:
+    """
+    Get the function store of this process, creating it in ``runwith_cache`` if needed.
+
+    Each process has its own store, so that removing its files never pulls them from
+    under the jobs of another process.
+
+    Returns:
+        Path: absolute path to the store directory
+    """
+    pid = os.getpid()
+    if pid not in STORE_DIRS or not STORE_DIRS[pid].exists():
+        root = Path.cwd() / "runwith_cache"
+        root.mkdir(exist_ok=True)
+        STORE_DIRS[pid] = Path(tempfile.mkdtemp(prefix=f"{pid}_", dir=root))
+    return STORE_DIRS[pid]
+
+
+def prepare_func(func: Callable, compression: Compression = "none") -> tuple[Path, list[Path]]:
+    """
+    Pickle a function into the content-addressed store in ``runwith_cache``.
+
+    The pickle is named after the blake2b digest of its content, so calls of the same
+    function share one file instead of each writing their own copy. Functions the
+    stdlib pickler stores by reference are only pickled once per session. Functions
+    pickled by value with cloudpickle are hashed again on every call, since their
+    closures and globals may have changed since, but only written if the digest is
+    new. Every call must be paired with a ``release_func`` call once the pickle is no
+    longer needed.
+
+    Args:
+        func (Callable): function to be pickled.
+        compression (Compression, optional): compression of the pickle stream.
+                Defaults to "none".
+
+    Returns:
+        tuple[Path, list[Path]]: path to the pickle and to its out-of-band buffers.
+    """
+    with FUNC_CACHE_LOCK:
+        try:
+            cached = FUNC_CACHE.get(func)
+        except TypeError:
+            cached = None
+        if cached is not None and cached[0].exists():
+            STORE_REFS[cached[0]] += 1
+            return cached
+
+        # Hash without writing first, so that a function already in the store costs
+        # no I/O. The compression is part of the digest, as it changes the file.
+        hasher = HashingWriter(person=compression.encode())
+
+        def hash_buffer(buf: pickle.PickleBuffer) -> None:
+            hasher.digest.update(buf.raw())
+
+        by_reference = dump(func, hasher, buffer_callback=hash_buffer)
+        path = store_dir() / f"{hasher.digest.hexdigest()}.func.pickle"
+        if path.exists():
+            buf_paths = buffer_paths(path)
+        else:
+            buf_paths = write_func(func, path, compression)
+        STORE_REFS[path] = STORE_REFS.get(path, 0) + 1
+
+        if by_reference:
+            try:
+                FUNC_CACHE[func] = (path, buf_paths)
+            except TypeError:
+                pass
+        return path, buf_paths
+
+
+def write_func(func: Callable, path: Path, compression: Compression) -> list[Path]:
+    """
+    Pickle a function into the store under temporary names and rename the files into
+    place, so that a present pickle is always complete.
+
+    Args:
+        func (Callable): function to be pickled.
+        path (Path): path to the pickle in the store.
+        compression (Compression): compression of the pickle stream.
+
+    Returns:
+        list[Path]: paths to the out-of-band buffers of the pickle.
+    """
+    tmp_path = path.with_name(f"{os.getpid()}.tmp")
+    tmp_buf_paths: list[Path] = []
+
+    def dump_buffer(buf: pickle.PickleBuffer) -> None:
+        buf_path = tmp_path.with_suffix(f".buf{len(tmp_buf_paths)}.tmp")
+        buf_path.write_bytes(buf.raw())
+        tmp_buf_paths.append(buf_path)
+
+    try:
+        with open(tmp_path, "wb", buffering=1 << 20) as f:
+            dump(func, f, buffer_callback=dump_buffer, compression=compression)
+    except BaseException:
+        for tmp in [tmp_path] + tmp_buf_paths:
+            tmp.unlink(missing_ok=True)
+        raise
+    buf_paths = [path.with_suffix(f".buf{i}.bin") for i in range(len(tmp_buf_paths))]
+    for tmp, buf_path in zip(tmp_buf_paths, buf_paths):
+        os.replace(tmp, buf_path)
+    os.replace(tmp_path, path)
+    return buf_paths
+
+
+def release_func(path: Path) -> None:
+    """
+    Release a pickle returned by ``prepare_func``, removing it from the store once no
+    prepared job of this process uses it anymore.
+
+    Args:
+        path (Path): path to the pickle
+    """
+    with FUNC_CACHE_LOCK:
+        STORE_REFS[path] -= 1
+        if STORE_REFS[path] > 0:
+            return
+        del STORE_REFS[path]
+        for buf_path in buffer_paths(path):
+            buf_path.unlink()
+        path.unlink(missing_ok=True)
+        if not STORE_REFS:
+            # runwith_cache itself stays while other processes have their stores in it.
+            for directory in (path.parent, path.parent.parent):
+                try:
+                    directory.rmdir()
+                except OSError:
+                    break
+
+
+def embeds_target(exec_template: str) -> bool:
+    """
+    Check whether the target script can be passed inline with ``-c``.
+
+    That is only the case if {target} appears once, as the only argument of a python
+    interpreter, e.g. ``/usr/bin/python3 {target}``. Templates using it otherwise,
+    such as ``bash -c "python {target}"`` or ``cat {target}``, need a real file.
+
+    Args:
+        exec_template (str): template for the shell script
+
+    Returns:
+        bool: True if {target} can be replaced by ``-c '<target script>'``
+    """
+    lines = [line for line in exec_template.splitlines() if "{target}" in line]
+    return (
+        exec_template.count("{target}") == 1
+        and PLAIN_TARGET_LINE.fullmatch(lines[0]) is not None
+    )
 
 
 def prepare(
@@ -75,6 +729,8 @@ def prepare(
     target_template: str = TARGET_TEMPLATE,
     exec_template: str = EXEC_TEMPLATE,
     verbose: bool = True,
+    transport: Transport = "file",
+    compression: Compression = "none",
 ) -> Assets:
     """
     Prepare the function to be run with in a different environment.
@@ -85,62 +741,149 @@ def prepare(
         kwargs (dict): keyword arguments to the function.
         target_template (str, optional): template for the target script. Defaults to TARGET_TEMPLATE.
         exec_template (str, optional): template for the shell script. Defaults to EXEC_TEMPLATE.
+                Its {target} placeholder is replaced by the path to the target script.
+                If it only appears in a plain ``python {target}`` line and the target
+                script is shorter than ``MAX_INLINE_TARGET``, it is replaced by
+                ``-c '<target script>'`` instead, which embeds the target script in
+                the shell script and saves writing a file.
         verbose (bool, optional): print the generated script. Defaults to True.
+        transport (Transport, optional): how the pickled function reaches the target.
+                "file" writes it to disk, "shm" passes it through a POSIX shared memory
+                segment and only works when the target runs on the same host.
+                Defaults to "file".
+        compression (Compression, optional): "zstd" or "lz4" to compress pickles larger
+                than 64 KiB with the "file" transport; needs the zstandard or lz4
+                package on both sides. Defaults to "none".
 
     Returns:
-        sh.Command: shell command to run the function.
+        Assets: generated files, including the executable script running the function.
     """
 
-    assert "{pickle_path}" in target_template, (
-        "template must contain {pickle_path} placeholder, but got " + target_template
-    )
     assert "{ret_path}" in target_template, (
         "template must contain {ret_path} placeholder, but got " + target_template
     )
+    if transport == "file":
+        assert "{func_path}" in target_template, (
+            "template must contain {func_path} placeholder, but got " + target_template
+        )
+        assert "{pickle_path}" in target_template, (
+            "template must contain {pickle_path} placeholder, but got " + target_template
+        )
     assert "{target}" in exec_template, (
         "template must contain {target} placeholder, but got " + exec_template
     )
 
-    def random_name() -> str:
-        letters = string.ascii_lowercase
-        name = "".join(random.choice(letters) for _ in range(10))
-        return name
+    assets = Assets(
+        base=make_dir() / func.__name__,
+        transport=transport,
+    )
+    try:
+        func_path, func_buffers = Path(), []
+        if transport == "shm":
+            data = dumps((func, args, kwargs))
+            assets.shm = SharedMemory(create=True, size=max(len(data), 1))
+            assets.shm.buf[: len(data)] = data
+            shebang, _, body = exec_template.partition("\n")
+            exec_template = f"{shebang}\nexport RUNWITH_SHM={assets.shm.name}\n{body}"
+            if verbose:
+                print(f"Pickled function to shared memory {assets.shm.name}")
+        else:
+            func_path, func_buffers = prepare_func(func, compression)
+            assets.func = func_path
+            assets.buffers = dump_pickle((args, kwargs), assets.dump, compression)
+            if verbose:
+                print(
+                    f"Pickled function to {func_path} "
+                    f"with {len(func_buffers)} out-of-band buffers"
+                )
+                print(
+                    f"Pickled arguments to {assets.dump} "
+                    f"with {len(assets.buffers)} out-of-band buffers"
+                )
+
+        target_script = target_template.format(
+            func_path=func_path,
+            func_buffer_paths=[str(path) for path in func_buffers],
+            pickle_path=assets.dump,
+            buffer_paths=[str(path) for path in assets.buffers],
+            ret_path=assets.ret,
+        )
+
+        if embeds_target(exec_template) and len(target_script) <= MAX_INLINE_TARGET:
+            target = f"-c {shlex.quote(target_script)}"
+        else:
+            assets.target.write_text(target_script, encoding="utf-8")
+            target = str(assets.target)
+            if verbose:
+                print(f"Generated target:\n{target_script}")
+        exec_script = exec_template.format(target=target)
+        assets.exec.write_text(exec_script, encoding="utf-8")
+
+        os.chmod(assets.exec, 0o755)
+        if verbose:
+            print(f"Generated executable:\n{exec_script}")
+    except BaseException:
+        assets.cleanup()
+        raise
 
-    assets = Assets(base=Path(f"runwith_{random_name()}", func.__name__).absolute())
+    return assets
 
-    func = partial(func, *args, **kwargs)
-    assets.dump.write_bytes(cloudpickle.dumps(func))
 
-    if verbose:
-        print(f"Pickled function to {assets.dump}")
+def decode_return(data: memoryview, buffers: Iterable[Any] = ()) -> Any:
+    """
+    Decode a return value written by the target.
 
-    target_script = target_template.format(
-        pickle_path=assets.dump,
-        ret_path=assets.ret,
-    )
+    The first byte tells how the rest was encoded: ``J`` for JSON, used by the target
+    for plain dicts/lists/strings/numbers, or ``P`` for pickle.
 
-    assets.target.write_text(target_script, encoding="utf-8")
-    if verbose:
-        print(f"Generated target:\n{target_script}")
+    Args:
+        data (memoryview): tagged return value
+        buffers (Iterable[Any], optional): out-of-band pickle buffers. Defaults to ().
 
-    assets.exec.write_text(exec_template.format(target=assets.target), encoding="utf-8")
+    Returns:
+        Any: return value
+    """
+    if data[:1] == b"J":
+        return json_loads(bytes(data[1:]))
+    return pickle.loads(data[1:], buffers=buffers)
 
-    sh.Command("chmod")("+x", assets.exec)
-    if verbose:
-        print(f"Generated executable:\n{exec_template.format(target=assets.target)}")
 
-    return assets
+def load_return(ret_path: Path, transport: Transport = "file") -> Any:
+    """
+    Load the return value from the return file and its out-of-band buffers.
 
+    The return file is unpickled as a stream through a buffered reader rather than
+    read into ``bytes`` first, and out-of-band buffers are memory-mapped, so NumPy
+    arrays are backed by the files without copies. The stdlib unpickler imports
+    cloudpickle by itself if the target had to fall back to it.
 
-def load_return(ret_path: Path) -> Any:
-    """
-    Load the return value from the return file.
+    With the "shm" transport the return file only names the shared memory segment
+    holding the pickled return value; the segment is unlinked once loaded.
 
     Args:
         ret_path (Path): path to the return file
+        transport (Transport, optional): transport used by the target. Defaults to "file".
 
     Returns:
         Any: return value
     """
-    ret = cloudpickle.loads(ret_path.read_bytes())
+    if transport == "shm":
+        name, size = ret_path.read_text().split()
+        shm = SharedMemory(name=name)
+        try:
+            view = shm.buf[: int(size)]
+            ret = decode_return(view)
+            view.release()
+        finally:
+            shm.close()
+            shm.unlink()
+        return ret
+
+    buffers = [load_buffer(path) for path in buffer_paths(ret_path)]
+    with open(ret_path, "rb", buffering=1 << 20) as f:
+        if f.read(1) == b"J":
+            ret = json_loads(f.read())
+        else:
+            ret = pickle.load(f, buffers=buffers)
+        drop_cache(f)
     return ret
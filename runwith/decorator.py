@@ -5,8 +5,8 @@ This module contains decorators to run functions in different environments.
 from functools import wraps
 from typing import Any, Callable, Union
 
-from runwith.common import EXEC_TEMPLATE
-from runwith.runners.interpreter import InterpreterRunner
+from runwith.common import EXEC_TEMPLATE, Compression, Transport
+from runwith.runners.interpreter import InterpreterRunner, PersistentInterpreterRunner
 from runwith.runners.slurm import SlurmOptions, SlurmRunner
 
 
@@ -14,6 +14,7 @@ def slurm(
     options: Union[SlurmOptions, dict[str, Any]],
     exec_template: str = EXEC_TEMPLATE,
     verbose: bool = True,
+    compression: Compression = "none",
 ) -> Callable:
     """
     Decorator to run a function with a slurm job.
@@ -33,8 +34,12 @@ def slurm(
     Args:
         options (Union[SlurmOptions, dict[str, Any]]): slurm options.
         template (str): custom script template.
-                The template must be contain a {target} placeholder.
+                The template must be contain a {target} placeholder, which is replaced by
+                the path to the generated python script. A plain ``python {target}``
+                line gets the script inline as ``python -c '<script>'`` instead.
         verbose (bool, optional): print the generated script. Defaults to True.
+        compression (Compression, optional): "zstd" or "lz4" to compress large pickled
+                functions before writing them. Defaults to "none".
 
     Returns:
         Callable: decorated function
@@ -45,7 +50,9 @@ def slurm(
     def decorator(func: Callable):
         @wraps(func)
         def wrapper(*args, **kwargs) -> Any:
-            job_runner = SlurmRunner(func, args, kwargs, exec_template, options, verbose)
+            job_runner = SlurmRunner(
+                func, args, kwargs, exec_template, options, verbose, compression
+            )
             return job_runner()
 
         return wrapper
@@ -53,7 +60,13 @@ def slurm(
     return decorator
 
 
-def interpreter(path: str, verbose: bool = True) -> Callable:
+def interpreter(
+    path: str,
+    verbose: bool = True,
+    transport: Transport = "file",
+    persistent: bool = False,
+    compression: Compression = "none",
+) -> Callable:
     """
     Decorator to run a function with a custom interpreter.
 
@@ -61,8 +74,16 @@ def interpreter(path: str, verbose: bool = True) -> Callable:
     interpreter("/usr/bin/python3")
 
     Args:
-        path (str): path to the custom interpreter
+        path (str): path to the custom interpreter. Interpreters named ``python*`` get
+                the generated script inline with ``-c``, others get a path to it.
         verbose (bool, optional): print the generated script. Defaults to True.
+        transport (Transport, optional): "file" to pass the function through pickle files,
+                "shm" to pass it through shared memory. Defaults to "file".
+        persistent (bool, optional): keep the interpreter alive between calls and send
+                it the function over a socket instead of starting it for every call.
+                The transport is not used in this case. Defaults to False.
+        compression (Compression, optional): "zstd" or "lz4" to compress large pickled
+                functions with the "file" transport. Defaults to "none".
 
     Returns:
         Callable: decorated function
@@ -71,7 +92,11 @@ def interpreter(path: str, verbose: bool = True) -> Callable:
     def decorator(func: Callable):
         @wraps(func)
         def wrapper(*args, **kwargs) -> Any:
-            interpreter_runner = InterpreterRunner(func, args, kwargs, path, verbose)
+            if persistent:
+                return PersistentInterpreterRunner(func, args, kwargs, path, verbose)()
+            interpreter_runner = InterpreterRunner(
+                func, args, kwargs, path, verbose, transport, compression
+            )
             return interpreter_runner()
 
         return wrapper
@@ -2,18 +2,49 @@
 This module contains the base class for all runners of python functions.
 """
 
+import io
+import os
+import signal
+import subprocess
 import sys
+import threading
 from functools import partial
-from typing import Any, Callable
+from typing import IO, Any, Callable, Optional, TextIO
 
-import cloudpickle
-import sh
-
-from runwith.common import Assets
+from runwith.common import Assets, load_return
 
 PrepareFuncion = Callable[[Callable, tuple, dict[str, Any], str, str, bool], Assets]
 
 
+def fileno(stream: TextIO) -> Optional[int]:
+    """
+    Get the file descriptor behind a stream, if it has one.
+
+    Args:
+        stream (TextIO): stream such as ``sys.stdout``
+
+    Returns:
+        Optional[int]: the file descriptor, or None for in-memory or detached streams
+    """
+    try:
+        return stream.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+def copy_stream(source: IO[bytes], target: TextIO) -> None:
+    """
+    Copy a child's output pipe into a stream line by line until it is closed.
+
+    Args:
+        source (IO[bytes]): read end of the pipe
+        target (TextIO): stream to write to
+    """
+    for line in iter(source.readline, b""):
+        target.write(line.decode(errors="replace"))
+    source.close()
+
+
 class Runner:
     """Base runner for a python function."""
 
@@ -35,6 +66,75 @@ class Runner:
         self.prepare = partial(prepare, func, args, kwargs, target_template, exec_template, verbose)
         self.verbose = verbose
 
+    def execute(self, assets: Assets) -> None:
+        """
+        Execute the prepared shell script and wait for it.
+
+        The script is started with ``os.posix_spawn`` where available, which avoids
+        copying the page tables of a parent holding large closures in memory. If
+        ``sys.stdout`` or ``sys.stderr`` has no file descriptor, the output is piped
+        and copied into it instead.
+
+        Args:
+            assets (Assets): prepared files of the job
+
+        Raises:
+            subprocess.CalledProcessError: if the script exits with a non-zero code
+        """
+        argv = [str(assets.exec)]
+        sys.stdout.flush()
+        sys.stderr.flush()
+        stdout, stderr = fileno(sys.stdout), fileno(sys.stderr)
+        if stdout is None or stderr is None or not hasattr(os, "posix_spawn"):
+            self._execute_piped(argv, stdout, stderr)
+            return
+        file_actions = [
+            (os.POSIX_SPAWN_DUP2, stdout, 1),
+            (os.POSIX_SPAWN_DUP2, stderr, 2),
+        ]
+        # The script gets its own process group so that an interrupted run can kill
+        # the interpreter it started along with it.
+        pid = os.posix_spawn(argv[0], argv, os.environ, file_actions=file_actions, setpgroup=0)
+        try:
+            _, status = os.waitpid(pid, 0)
+        except BaseException:
+            os.killpg(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            raise
+        returncode = os.waitstatus_to_exitcode(status)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, argv)
+
+    @staticmethod
+    def _execute_piped(argv: list[str], stdout: Optional[int], stderr: Optional[int]) -> None:
+        # Streams without a file descriptor (StringIO, notebooks, captured output)
+        # are fed from pipes instead.
+        with subprocess.Popen(
+            argv,
+            stdout=subprocess.PIPE if stdout is None else stdout,
+            stderr=subprocess.PIPE if stderr is None else stderr,
+            start_new_session=True,
+        ) as process:
+            threads = [
+                threading.Thread(target=copy_stream, args=(pipe, stream), daemon=True)
+                for pipe, stream in ((process.stdout, sys.stdout), (process.stderr, sys.stderr))
+                if pipe is not None
+            ]
+            try:
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                returncode = process.wait()
+            except BaseException:
+                if hasattr(os, "killpg"):
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+                raise
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, argv)
+
     def run(self) -> Any:
         """
         Run the job in a slurm environment.
@@ -43,10 +143,10 @@ class Runner:
             Any: return value of the function
         """
         assets = self.prepare()
-        sh.Command(assets.exec)(_out=sys.stdout, _err=sys.stderr)
         try:
-            ret = cloudpickle.loads(assets.ret.read_bytes())
-        except Exception as e:
+            self.execute(assets)
+            ret = load_return(assets.ret, assets.transport)
+        except BaseException as e:
             assets.cleanup()
             raise e
         assets.cleanup()
@@ -2,9 +2,29 @@
 This module contains the runner for a python function in a custom interpreter.
 """
 
-from typing import Any, Callable
+import atexit
+import pickle
+import shlex
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from functools import partial
+from pathlib import Path
+from typing import IO, Any, Callable, Optional
 
-from runwith.common import TARGET_TEMPLATE, prepare
+from runwith.common import (
+    RETURN_ENCODER,
+    SHM_TARGET_TEMPLATE,
+    TARGET_TEMPLATE,
+    Compression,
+    Transport,
+    decode_return,
+    dumps,
+    prepare,
+)
 from runwith.runners.base import Runner
 
 
@@ -18,15 +38,207 @@ class InterpreterRunner(Runner):
         kwargs: dict[str, Any],
         interpreter: str,
         verbose: bool = True,
+        transport: Transport = "file",
+        compression: Compression = "none",
     ) -> None:
         exec_template = f"#!/bin/bash\n{interpreter} {{target}}\n\n"
         super().__init__(
             func,
             args,
             kwargs,
-            TARGET_TEMPLATE,
+            SHM_TARGET_TEMPLATE if transport == "shm" else TARGET_TEMPLATE,
             exec_template,
-            prepare,
+            partial(prepare, transport=transport, compression=compression),
             verbose,
         )
         self.interpreter = interpreter
+        self.transport = transport
+        self.compression = compression
+
+
+WORKER_TEMPLATE = RETURN_ENCODER + """import os
+import pickle
+import socket
+import struct
+import sys
+
+
+def recv_exact(conn, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    while view:
+        received = conn.recv_into(view)
+        if received == 0:
+            raise EOFError("connection closed by the caller")
+        view = view[received:]
+    return data
+
+
+def send_frame(conn, data):
+    conn.sendall(struct.pack("!Q", len(data)))
+    conn.sendall(data)
+
+
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(sys.argv[1])
+server.listen()
+while True:
+    conn, _ = server.accept()
+    with conn:
+        (size,) = struct.unpack("!Q", recv_exact(conn, 8))
+        if size == 0:
+            break
+        try:
+            func, args, kwargs = pickle.loads(recv_exact(conn, size))
+            ret = func(*args, **kwargs)
+            data = encode_json(ret)
+            data = b"P" + pickle.dumps(ret, protocol=5) if data is None else b"J" + data
+        except Exception as e:
+            try:
+                data = b"E" + pickle.dumps(e, protocol=5)
+            except Exception:
+                data = b"E" + pickle.dumps(RuntimeError(repr(e)), protocol=5)
+        send_frame(conn, data)
+server.close()
+os.unlink(sys.argv[1])
+
+"""
+
+
+class Worker:
+    """A warm interpreter serving function calls over a Unix domain socket."""
+
+    def __init__(self, interpreter: str, verbose: bool = True) -> None:
+        self.interpreter = interpreter
+        self.socket_path = Path(tempfile.mkdtemp(prefix="runwith_"), "worker.sock")
+        self.process = subprocess.Popen(
+            f"exec {interpreter} -c {shlex.quote(WORKER_TEMPLATE)} "
+            + shlex.quote(str(self.socket_path)),
+            shell=True,
+        )
+        if verbose:
+            print(f"Started worker {self.process.pid} listening on {self.socket_path}")
+
+    def connect(self) -> socket.socket:
+        """
+        Connect to the worker, waiting for it to start listening.
+
+        Raises:
+            RuntimeError: if the worker exited
+
+        Returns:
+            socket.socket: connection to the worker
+        """
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Worker exited with code {self.process.returncode}")
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.connect(str(self.socket_path))
+                return conn
+            except (FileNotFoundError, ConnectionRefusedError):
+                conn.close()
+                time.sleep(0.01)
+
+    def call(self, func: Callable, args: tuple, kwargs: dict[str, Any]) -> Any:
+        """
+        Run a function in the worker.
+
+        Args:
+            func (Callable): function to be run.
+            args (tuple): arguments to the function.
+            kwargs (dict): keyword arguments to the function.
+
+        Raises:
+            RuntimeError: if the worker exits before replying
+
+        Returns:
+            Any: return value of the function
+        """
+        payload = dumps((func, args, kwargs))
+        with self.connect() as conn:
+            try:
+                conn.sendall(struct.pack("!Q", len(payload)))
+                conn.sendall(payload)
+                with conn.makefile("rb") as f:
+                    data = self._read_frame(f)
+            except OSError:
+                data = None
+        if data is None:
+            try:
+                code = self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                code = None
+            raise RuntimeError(
+                f"Worker {self.process.pid} for {self.interpreter} exited with code {code} "
+                f"before returning from {getattr(func, '__name__', func)}"
+            )
+        if data[:1] == b"E":
+            raise pickle.loads(data[1:])
+        return decode_return(memoryview(data))
+
+    @staticmethod
+    def _read_frame(f: IO[bytes]) -> Optional[bytes]:
+        # A short read means the worker closed the connection, usually by dying.
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        (size,) = struct.unpack("!Q", header)
+        data = f.read(size)
+        return data if len(data) == size else None
+
+    def close(self) -> None:
+        """
+        Ask the worker to exit and wait for it, killing it if it does not respond.
+        """
+        if self.process.poll() is None:
+            try:
+                with self.connect() as conn:
+                    conn.sendall(struct.pack("!Q", 0))
+                self.process.wait(timeout=10)
+            except (OSError, RuntimeError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        # A worker that died does not remove its socket.
+        self.socket_path.unlink(missing_ok=True)
+        self.socket_path.parent.rmdir()
+
+
+WORKERS: dict[str, Worker] = {}
+WORKERS_LOCK = threading.Lock()
+
+
+@atexit.register
+def close_workers() -> None:
+    """
+    Shut down all the persistent workers.
+    """
+    with WORKERS_LOCK:
+        while WORKERS:
+            _, worker = WORKERS.popitem()
+            worker.close()
+
+
+class PersistentInterpreterRunner(InterpreterRunner):
+    """
+    Runner for a python function in a custom interpreter kept alive between calls.
+
+    The first call for an interpreter starts a worker, later calls reuse it and skip
+    both writing the scripts and the interpreter startup.
+    """
+
+    def run(self) -> Any:
+        """
+        Run the function in the persistent worker of the interpreter.
+
+        Returns:
+            Any: return value of the function
+        """
+        with WORKERS_LOCK:
+            worker = WORKERS.get(self.interpreter)
+            if worker is None or worker.process.poll() is not None:
+                # Replace a worker that died, e.g. because a function called sys.exit.
+                if worker is not None:
+                    worker.close()
+                worker = WORKERS[self.interpreter] = Worker(self.interpreter, self.verbose)
+        return worker.call(self.func, self.args, self.kwargs)
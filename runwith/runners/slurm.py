@@ -2,16 +2,74 @@
 This modules contains utility functions related to slurm
 """
 
+import copy
 import json
-from dataclasses import asdict, dataclass, field
-from typing import Any, Callable, NoReturn, Optional, TextIO
+import shlex
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Any, Callable, Optional, TextIO
 
+import sh
 import simple_slurm
 
-from runwith.common import TARGET_TEMPLATE, load_return, prepare
+from runwith.common import (
+    TARGET_TEMPLATE,
+    Assets,
+    Compression,
+    load_return,
+    make_dir,
+    prepare,
+)
 from runwith.runners.base import Runner
 
+ARRAY_TEMPLATE = """#!/bin/bash
+exec bash "$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {manifest})"
 
+"""
+
+FINISHED_STATES = {
+    "BOOT_FAIL",
+    "CANCELLED",
+    "COMPLETED",
+    "DEADLINE",
+    "FAILED",
+    "NODE_FAIL",
+    "OUT_OF_MEMORY",
+    "PREEMPTED",
+    "TIMEOUT",
+}
+
+
+def add_slots(*extra: str) -> Callable[[type], type]:
+    """
+    Recreate a dataclass with ``__slots__`` for its fields, as ``dataclass(slots=True)``
+    does on Python 3.10+.
+
+    Args:
+        extra (str): names of additional non-field slots
+
+    Returns:
+        Callable[[type], type]: class decorator
+    """
+
+    def decorator(cls: type) -> type:
+        names = tuple(f.name for f in fields(cls))
+        namespace = {
+            key: value
+            for key, value in cls.__dict__.items()
+            if key not in names and key not in ("__dict__", "__weakref__")
+        }
+        namespace["__slots__"] = names + extra
+        return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+    return decorator
+
+
+@add_slots("_dict_cache")
 @dataclass
 class SlurmOptions:
     """Class to manage slurm options."""
@@ -150,7 +208,53 @@ class SlurmOptions:
         Returns:
             Dict[str, Any]: dictionary with the options
         """
-        return {k: v for k, v in asdict(self).items() if v is not None}
+        if getattr(self, "_dict_cache", None) is None:
+            self._dict_cache = {
+                name: value
+                for name in self.__dataclass_fields__
+                if (value := getattr(self, name)) is not None
+            }
+        return dict(self._dict_cache)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        if name != "_dict_cache":
+            object.__setattr__(self, "_dict_cache", None)
+
+
+@lru_cache(maxsize=128)
+def _validated_slurm(options: tuple[tuple[str, Any], ...]) -> simple_slurm.Slurm:
+    slurm = simple_slurm.Slurm()
+    slurm.add_arguments(**dict(options))
+    return slurm
+
+
+def make_slurm(options: dict[str, Any]) -> simple_slurm.Slurm:
+    """
+    Build a ``simple_slurm.Slurm`` with the given arguments.
+
+    simple_slurm validates every argument when it is added, so instances validated
+    for the same options (ignoring the job name) are cached and each call returns a
+    copy of the cached one with its own job name added.
+
+    Args:
+        options (dict[str, Any]): slurm options
+
+    Returns:
+        simple_slurm.Slurm: slurm instance with the arguments added
+    """
+    options = dict(options)
+    job_name = options.pop("job_name", None)
+    cached = _validated_slurm(tuple(sorted(options.items())))
+    # Only the parsed arguments and queued commands differ between instances, the
+    # argparse parser is shared.
+    slurm = copy.copy(cached)
+    slurm.namespace = copy.copy(cached.namespace)
+    if hasattr(cached, "run_cmds"):
+        slurm.run_cmds = []
+    if job_name is not None:
+        slurm.add_arguments(job_name=job_name)
+    return slurm
 
 
 class SlurmRunner(Runner):
@@ -166,24 +270,43 @@ class SlurmRunner(Runner):
         sh_template: str,
         options: SlurmOptions = SlurmOptions(),
         verbose: bool = True,
+        compression: Compression = "none",
     ):
-        super().__init__(func, args, kwargs, TARGET_TEMPLATE, sh_template, prepare, verbose)
+        super().__init__(
+            func,
+            args,
+            kwargs,
+            TARGET_TEMPLATE,
+            sh_template,
+            partial(prepare, compression=compression),
+            verbose,
+        )
         self.options = options
-        self.slurm = simple_slurm.Slurm()
-        self.slurm.add_arguments(**self.options.to_dict())
+        self.compression = compression
+        self.slurm = make_slurm(self.options.to_dict())
 
-    def run(self) -> Any:
+    def execute(self, assets: Assets) -> None:
         """
-        Run the job in a slurm environment.
+        Execute the prepared shell script as a slurm job step and wait for it.
+
+        Args:
+            assets (Assets): prepared files of the job
+        """
+        # simple_slurm queues the commands it runs, so every call gets its own copy.
+        make_slurm(self.options.to_dict()).srun(f"bash {shlex.quote(str(assets.exec))}")
+
+    def submit(self) -> int:
+        """
+        Submit the job with sbatch without waiting for it.
+
+        The generated files are left in place for the job to use.
 
         Returns:
-            Any: return value of the function
+            int: slurm job id
         """
         assets = self.prepare()
-        self.slurm.srun("bash", str(assets.exec))
-        ret = load_return(assets.ret)
-        assets.cleanup()
-        return ret
+        slurm = make_slurm(self.options.to_dict())
+        return slurm.sbatch(f"bash {shlex.quote(str(assets.exec))}")
 
     def __str__(self) -> str:
         return (
@@ -201,6 +324,9 @@ class JobGroup:
     """Class to manage multiple jobs."""
 
     jobs: list[SlurmRunner] = field(default_factory=list)
+    max_workers: int = 16
+    max_array_size: int = 1000
+    max_concurrent: Optional[int] = None
 
     def add_job(self, job: SlurmRunner):
         """
@@ -211,8 +337,174 @@ class JobGroup:
         """
         self.jobs.append(job)
 
-    def run_all(self) -> NoReturn:
+    def submit_all(self) -> list[str]:
         """
-        Run all jobs in the manager in parallel.
+        Submit all jobs in the manager without waiting for them.
+
+        Jobs sharing the same slurm options (ignoring the job name) are submitted
+        together as ``sbatch --array`` jobs of at most ``max_array_size`` tasks, which
+        must not exceed the cluster's ``MaxArraySize``. If ``max_concurrent`` is set,
+        at most that many tasks of each array run at once (``--array=0-N%K``). Their
+        files are prepared by up to ``max_workers`` threads. If a submission fails,
+        the arrays submitted before it are cancelled and all the files are removed.
+
+        Returns:
+            list[str]: slurm job ids of the jobs, as ``<array job id>_<task id>``
+        """
+        submitted, _ = self._submit_arrays()
+        return [job_id for job_id, _ in submitted]
+
+    def run_all(self, poll_interval: float = 10.0, timeout: Optional[float] = None) -> list[Any]:
+        """
+        Run all jobs in the manager in parallel and wait for them to finish.
+
+        Args:
+            poll_interval (float, optional): seconds between ``sacct`` polls. Defaults to 10.
+            timeout (Optional[float], optional): seconds to wait for the jobs before
+                raising ``TimeoutError``. Defaults to waiting forever.
+
+        Returns:
+            list[Any]: return values of the jobs, in the order they were added
         """
-        raise NotImplementedError("This method is not implemented yet.")
+        submitted: list[tuple[str, Assets]] = []
+        group_dirs: list[Path] = []
+        try:
+            submitted, group_dirs = self._submit_arrays()
+            states = wait_for_jobs([job_id for job_id, _ in submitted], poll_interval, timeout)
+            failed = {
+                job_id: state for job_id, state in states.items() if state != "COMPLETED"
+            }
+            if failed:
+                raise RuntimeError(f"Some jobs did not complete: {failed}")
+            return [load_return(assets.ret) for _, assets in submitted]
+        finally:
+            cleanup([assets for _, assets in submitted], group_dirs)
+
+    def _submit_arrays(self) -> tuple[list[tuple[str, Assets]], list[Path]]:
+        groups: dict[tuple, list[int]] = {}
+        for i, job in enumerate(self.jobs):
+            options = job.options.to_dict()
+            options.pop("job_name", None)
+            groups.setdefault(tuple(sorted(options.items())), []).append(i)
+        chunks = [
+            indices[start : start + self.max_array_size]
+            for indices in groups.values()
+            for start in range(0, len(indices), self.max_array_size)
+        ]
+
+        # Preparing is mostly file writes, which release the GIL.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(job.prepare) for job in self.jobs]
+        prepared = [future.result() for future in futures if future.exception() is None]
+
+        submitted: dict[int, tuple[str, Assets]] = {}
+        group_dirs: list[Path] = []
+        array_ids: list[str] = []
+        try:
+            if len(prepared) < len(futures):
+                for future in futures:
+                    future.result()
+            for indices in chunks:
+                assets = [prepared[i] for i in indices]
+                group_dir = make_dir()
+                group_dirs.append(group_dir)
+                manifest = group_dir / "manifest.txt"
+                manifest.write_text("".join(f"{a.exec}\n" for a in assets), encoding="utf-8")
+                wrapper = group_dir / "array.sh"
+                wrapper.write_text(
+                    ARRAY_TEMPLATE.format(manifest=shlex.quote(str(manifest))), encoding="utf-8"
+                )
+
+                array = f"0-{len(indices) - 1}"
+                if self.max_concurrent is not None:
+                    array += f"%{self.max_concurrent}"
+                slurm = make_slurm({**self.jobs[indices[0]].options.to_dict(), "array": array})
+                array_id = slurm.sbatch(f"bash {shlex.quote(str(wrapper))}")
+                array_ids.append(str(array_id))
+                for task_id, (i, asset) in enumerate(zip(indices, assets)):
+                    submitted[i] = (f"{array_id}_{task_id}", asset)
+        except BaseException:
+            # Do not leave arrays running that nobody waits for, nor their files behind.
+            try:
+                if array_ids:
+                    sh.Command("scancel")(*array_ids)
+            finally:
+                cleanup(prepared, group_dirs)
+            raise
+        return [submitted[i] for i in range(len(self.jobs))], group_dirs
+
+
+def cleanup(assets: list[Assets], group_dirs: list[Path]) -> None:
+    """
+    Remove the files of jobs and the array directories of their groups.
+
+    Args:
+        assets (list[Assets]): prepared files of the jobs
+        group_dirs (list[Path]): directories holding the manifests and array wrappers
+    """
+    for job_assets in assets:
+        job_assets.cleanup()
+    for group_dir in group_dirs:
+        shutil.rmtree(group_dir)
+
+
+def expand_job_id(job_id: str) -> list[str]:
+    """
+    Expand a ``sacct`` record of not yet started array tasks, such as
+    ``123_[0-3,7%2]``, into the ids of the single tasks.
+
+    Args:
+        job_id (str): job id as printed by ``sacct``
+
+    Returns:
+        list[str]: the task ids, or ``[job_id]`` if it is not a task range
+    """
+    array_id, _, tasks = job_id.partition("_[")
+    if not tasks.endswith("]"):
+        return [job_id]
+    job_ids = []
+    for task_range in tasks[:-1].split("%")[0].split(","):
+        task_range, _, step = task_range.partition(":")
+        first, _, last = task_range.partition("-")
+        for task_id in range(int(first), int(last or first) + 1, int(step or 1)):
+            job_ids.append(f"{array_id}_{task_id}")
+    return job_ids
+
+
+def wait_for_jobs(
+    job_ids: list[str], poll_interval: float = 10.0, timeout: Optional[float] = None
+) -> dict[str, str]:
+    """
+    Poll ``sacct`` until all the given jobs have finished.
+
+    Args:
+        job_ids (list[str]): slurm job ids to wait for
+        poll_interval (float, optional): seconds between polls. Defaults to 10.
+        timeout (Optional[float], optional): seconds to wait before raising
+            ``TimeoutError``. Defaults to waiting forever.
+
+    Returns:
+        dict[str, str]: final state of each job, e.g. "COMPLETED" or "FAILED"
+    """
+    states: dict[str, str] = {}
+    pending = set(job_ids)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while pending:
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"Jobs did not finish within {timeout} seconds: {sorted(pending)}")
+        time.sleep(poll_interval)
+        array_ids = sorted({job_id.split("_")[0] for job_id in pending})
+        output = sh.Command("sacct")(
+            "-n", "-X", "-P", "-o", "JobID,State", "-j", ",".join(array_ids)
+        )
+        for line in str(output).splitlines():
+            record, _, state = line.partition("|")
+            state = state.split(" ")[0]
+            if state not in FINISHED_STATES:
+                continue
+            # Tasks cancelled before they started are reported as one ranged record.
+            for job_id in expand_job_id(record):
+                if job_id in pending:
+                    states[job_id] = state
+                    pending.discard(job_id)
+    return states
@@ -0,0 +1,61 @@
+"""
+Tests for executing the generated scripts.
+"""
+
+import contextlib
+import io
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from runwith.common import prepare
+from runwith.runners.base import Runner
+
+
+def noop():
+    pass
+
+
+class TestExecute(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.runner = Runner(noop, (), {}, "", "", prepare, verbose=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def script(self, exit_code: int) -> SimpleNamespace:
+        path = Path(self.tmp.name, "job.sh")
+        path.write_text(f"#!/bin/bash\necho out\necho err >&2\nexit {exit_code}\n")
+        path.chmod(0o755)
+        return SimpleNamespace(exec=path)
+
+    def test_output_is_copied_into_streams_without_fileno(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            self.runner.execute(self.script(0))
+        self.assertEqual(stdout.getvalue(), "out\n")
+        self.assertEqual(stderr.getvalue(), "err\n")
+
+    def test_piped_exit_code_is_raised(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            with self.assertRaises(subprocess.CalledProcessError) as error:
+                self.runner.execute(self.script(3))
+        self.assertEqual(error.exception.returncode, 3)
+        self.assertEqual(stdout.getvalue(), "out\n")
+
+    def test_output_goes_to_file_descriptors(self):
+        with tempfile.TemporaryFile("w+") as stdout, tempfile.TemporaryFile("w+") as stderr:
+            with mock.patch("sys.stdout", stdout), mock.patch("sys.stderr", stderr):
+                with self.assertRaises(subprocess.CalledProcessError) as error:
+                    self.runner.execute(self.script(4))
+                self.runner.execute(self.script(0))
+            stdout.seek(0)
+            stderr.seek(0)
+            self.assertEqual(stdout.read(), "out\nout\n")
+            self.assertEqual(stderr.read(), "err\nerr\n")
+        self.assertEqual(error.exception.returncode, 4)
@@ -0,0 +1,305 @@
+"""
+Tests for the pickling, compression and return encoding helpers.
+"""
+
+import importlib
+import importlib.util
+import io
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import cloudpickle
+
+from runwith import common
+from runwith.common import (
+    COMPRESSION_THRESHOLD,
+    EXEC_TEMPLATE,
+    RETURN_ENCODER,
+    STORE_REFS,
+    CompressingWriter,
+    decode_return,
+    dump,
+    dump_pickle,
+    embeds_target,
+    load_buffer,
+    load_return,
+    prepare,
+    prepare_func,
+    release_func,
+)
+
+
+class Blob:
+    """Object exposing its data as an out-of-band buffer."""
+
+    def __init__(self, data: bytearray) -> None:
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5:
+            return (Blob, (pickle.PickleBuffer(self.data),))
+        return (Blob, (bytes(self.data),))
+
+
+def add(a, b):
+    return a + b
+
+
+def encode_json(obj):
+    namespace = {}
+    exec(RETURN_ENCODER, namespace)  # pylint: disable=exec-used
+    return namespace["encode_json"](obj)
+
+
+class TestDump(unittest.TestCase):
+    def test_stdlib_pickles_by_reference(self):
+        f = io.BytesIO()
+        self.assertTrue(dump(add, f))
+        self.assertIs(pickle.loads(f.getvalue()), add)
+
+    def test_lambda_falls_back_to_cloudpickle(self):
+        f = io.BytesIO()
+        self.assertFalse(dump(lambda x: x + 1, f))
+        self.assertEqual(pickle.loads(f.getvalue())(1), 2)
+
+    def test_main_string_falls_back_to_cloudpickle(self):
+        obj = {"module": "__main__", "values": list(range(1000))}
+        f = io.BytesIO()
+        self.assertFalse(dump(obj, f))
+        self.assertEqual(pickle.loads(f.getvalue()), obj)
+
+    def test_fallback_forwards_buffers_once(self):
+        buffers = []
+        f = io.BytesIO()
+        self.assertFalse(dump((Blob(bytearray(b"abc")), "__main__"), f, buffers.append))
+        self.assertEqual(len(buffers), 1)
+        blob, name = pickle.loads(f.getvalue(), buffers=buffers)
+        self.assertEqual(bytes(blob.data), b"abc")
+        self.assertEqual(name, "__main__")
+
+    def test_module_registered_by_value_is_not_referenced(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            Path(tmp, "runwith_localmod.py").write_text("def h(x):\n    return x * 2\n")
+            sys.path.insert(0, tmp)
+            try:
+                module = importlib.import_module("runwith_localmod")
+            finally:
+                sys.path.remove(tmp)
+        cloudpickle.register_pickle_by_value(module)
+        try:
+            f = io.BytesIO()
+            self.assertFalse(dump(module.h, f))
+        finally:
+            cloudpickle.unregister_pickle_by_value(module)
+            del sys.modules["runwith_localmod"]
+        # The module can no longer be imported, as on a target without it.
+        self.assertEqual(pickle.loads(f.getvalue())(2), 4)
+
+
+class TestReturnEncoding(unittest.TestCase):
+    def test_json_types_are_tagged_json(self):
+        ret = {"a": [1, 2.5, None, True, "s"]}
+        data = encode_json(ret)
+        self.assertIsNotNone(data)
+        self.assertEqual(decode_return(memoryview(b"J" + data)), ret)
+
+    def test_other_types_are_pickled(self):
+        for ret in [(1, 2), {1: "a"}, float("nan"), [float("inf")], {"a": (1,)}]:
+            with self.subTest(ret=ret):
+                self.assertIsNone(encode_json(ret))
+
+    def test_pickled_return_round_trips(self):
+        ret = decode_return(memoryview(b"P" + pickle.dumps({1: (2, 3)}, protocol=5)))
+        self.assertEqual(ret, {1: (2, 3)})
+
+
+class TestCompressingWriter(unittest.TestCase):
+    def test_small_stream_is_not_compressed(self):
+        f = io.BytesIO()
+        writer = CompressingWriter(f, "zstd")
+        writer.write(b"x" * 100)
+        writer.finish()
+        self.assertEqual(f.getvalue(), b"x" * 100)
+
+    @unittest.skipUnless(importlib.util.find_spec("zstandard"), "zstandard not installed")
+    def test_large_stream_is_zstd_compressed(self):
+        import zstandard
+
+        data = b"x" * (COMPRESSION_THRESHOLD + 1)
+        f = io.BytesIO()
+        writer = CompressingWriter(f, "zstd")
+        writer.write(data[:1000])
+        writer.write(data[1000:])
+        writer.finish()
+        self.assertEqual(f.getvalue()[:4], bytes.fromhex("28b52ffd"))
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(f.getvalue()))
+        self.assertEqual(reader.read(), data)
+
+    @unittest.skipUnless(importlib.util.find_spec("lz4"), "lz4 not installed")
+    def test_large_stream_is_lz4_compressed(self):
+        import lz4.frame
+
+        data = b"x" * (COMPRESSION_THRESHOLD + 1)
+        f = io.BytesIO()
+        writer = CompressingWriter(f, "lz4")
+        writer.write(data)
+        writer.finish()
+        self.assertEqual(f.getvalue()[:4], bytes.fromhex("04224d18"))
+        self.assertEqual(lz4.frame.decompress(f.getvalue()), data)
+
+
+class TestOutOfBandBuffers(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name, "obj.pickle")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_dump_pickle_writes_buffers_to_side_files(self):
+        obj = (Blob(bytearray(b"abc" * 1000)), Blob(bytearray()))
+        paths = dump_pickle(obj, self.path)
+        self.assertEqual(paths, [self.path.with_suffix(f".buf{i}.bin") for i in range(2)])
+        self.assertEqual(paths[0].read_bytes(), b"abc" * 1000)
+        self.assertLess(os.path.getsize(self.path), 1000)
+
+        with open(self.path, "rb") as f:
+            loaded = pickle.load(f, buffers=[load_buffer(path) for path in paths])
+        self.assertEqual(bytes(loaded[0].data), b"abc" * 1000)
+        self.assertEqual(bytes(loaded[1].data), b"")
+
+    def test_load_return_maps_buffers(self):
+        buffers = []
+        data = pickle.dumps(Blob(bytearray(b"xyz")), protocol=5, buffer_callback=buffers.append)
+        self.path.write_bytes(b"P" + data)
+        self.path.with_suffix(".buf0.bin").write_bytes(buffers[0].raw())
+        ret = load_return(self.path)
+        self.assertEqual(bytes(ret.data), b"xyz")
+        ret.data[:1] = b"a"
+        self.assertEqual(self.path.with_suffix(".buf0.bin").read_bytes(), b"xyz")
+
+
+class TestEmbedsTarget(unittest.TestCase):
+    def test_plain_python_lines_are_embedded(self):
+        for template in [
+            EXEC_TEMPLATE,
+            "#!/bin/bash\n/usr/bin/python3.11 {target}\n",
+            "#!/bin/bash\nmodule load python\nexec python {target}\n",
+        ]:
+            with self.subTest(template=template):
+                self.assertTrue(embeds_target(template))
+
+    def test_other_uses_need_a_file(self):
+        for template in [
+            'bash -c "python {target}"',
+            "cat {target}",
+            "cat {target}\npython {target}",
+            "singularity exec image.sif python {target}",
+            "python {target} --flag",
+            "/opt/pypy/bin/pypy3 {target}",
+        ]:
+            with self.subTest(template=template):
+                self.assertFalse(embeds_target(template))
+
+
+class TestPrepareTarget(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def run_script(self, assets):
+        subprocess.run([str(assets.exec)], check=True)
+        return load_return(assets.ret)
+
+    def test_inline_script_with_many_buffers(self):
+        exec_template = f"#!/bin/bash\n{sys.executable} {{target}}\n"
+        buffers = [pickle.PickleBuffer(bytearray(b"x")) for _ in range(3000)]
+        assets = prepare(len, (buffers,), {}, exec_template=exec_template, verbose=False)
+        try:
+            self.assertEqual(len(assets.buffers), 3000)
+            self.assertFalse(assets.target.exists())
+            self.assertEqual(self.run_script(assets), 3000)
+        finally:
+            assets.cleanup()
+
+    @unittest.skipUnless(importlib.util.find_spec("zstandard"), "zstandard not installed")
+    def test_compressed_arguments(self):
+        data = b"x" * (COMPRESSION_THRESHOLD + 1)
+        exec_template = f"#!/bin/bash\n{sys.executable} {{target}}\n"
+        assets = prepare(
+            len, (data,), {}, exec_template=exec_template, verbose=False, compression="zstd"
+        )
+        try:
+            with open(assets.dump, "rb") as f:
+                self.assertEqual(f.read(4), bytes.fromhex("28b52ffd"))
+            self.assertEqual(self.run_script(assets), len(data))
+        finally:
+            assets.cleanup()
+
+    def test_target_file_for_other_templates(self):
+        exec_template = f'#!/bin/bash\nbash -c "{sys.executable} {{target}}"\n'
+        assets = prepare(len, ([1, 2],), {}, exec_template=exec_template, verbose=False)
+        try:
+            self.assertTrue(assets.target.exists())
+            self.assertEqual(self.run_script(assets), 2)
+        finally:
+            assets.cleanup()
+
+
+class TestFunctionStore(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_calls_share_one_pickle_until_released(self):
+        first = prepare(add, (1, 2), {}, verbose=False)
+        second = prepare(add, (3, 4), {}, verbose=False)
+        self.assertEqual(first.func, second.func)
+        self.assertEqual(STORE_REFS[first.func], 2)
+        first.cleanup()
+        self.assertTrue(second.func.exists())
+        second.cleanup()
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_closures_are_only_written_when_new(self):
+        scale = 2
+
+        def scaled(x):
+            return x * scale
+
+        with mock.patch("runwith.common.write_func", wraps=common.write_func) as write:
+            path, _ = prepare_func(scaled)
+            self.assertEqual(prepare_func(scaled)[0], path)
+            self.assertEqual(write.call_count, 1)
+            scale = 3
+            changed, _ = prepare_func(scaled)
+            self.assertEqual(write.call_count, 2)
+        self.assertNotEqual(changed, path)
+        with open(changed, "rb") as f:
+            self.assertEqual(pickle.load(f)(1), 3)
+        for released in (path, path, changed):
+            release_func(released)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_failed_prepare_releases_everything(self):
+        with self.assertRaises(TypeError):
+            prepare(add, (threading.Lock(), 1), {}, verbose=False)
+        self.assertEqual(STORE_REFS, {})
+        self.assertEqual(os.listdir(self.tmp.name), [])
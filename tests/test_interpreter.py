@@ -0,0 +1,93 @@
+"""
+Tests for running functions in another interpreter.
+"""
+
+import operator
+import os
+import sys
+import tempfile
+import unittest
+from multiprocessing.shared_memory import SharedMemory
+
+from runwith.common import SHM_TARGET_TEMPLATE, prepare
+from runwith.runners.interpreter import (
+    WORKERS,
+    InterpreterRunner,
+    PersistentInterpreterRunner,
+    close_workers,
+)
+
+
+class InterpreterTestCase(unittest.TestCase):
+    """Runs each test in an empty working directory for the generated files."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def assertCleanedUp(self):
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+
+@unittest.skipUnless(os.path.isdir("/dev/shm"), "POSIX shared memory not mounted")
+class TestSharedMemoryTransport(InterpreterTestCase):
+    def segments(self):
+        return set(os.listdir("/dev/shm"))
+
+    def test_round_trip(self):
+        before = self.segments()
+        runner = InterpreterRunner(operator.add, (2, 3), {}, sys.executable, False, "shm")
+        self.assertEqual(runner(), 5)
+        runner = InterpreterRunner(divmod, (7, 2), {}, sys.executable, False, "shm")
+        self.assertEqual(runner(), (3, 1))
+        self.assertEqual(self.segments(), before)
+        self.assertCleanedUp()
+
+    def test_cleanup_unlinks_segment(self):
+        assets = prepare(
+            operator.add, (1, 2), {}, SHM_TARGET_TEMPLATE, verbose=False, transport="shm"
+        )
+        name = assets.shm.name
+        assets.cleanup()
+        with self.assertRaises(FileNotFoundError):
+            SharedMemory(name=name)
+
+
+class TestPersistentWorker(unittest.TestCase):
+    def tearDown(self):
+        close_workers()
+
+    def run_in_worker(self, func, *args):
+        return PersistentInterpreterRunner(func, args, {}, sys.executable, verbose=False)()
+
+    def test_worker_is_reused(self):
+        self.assertEqual(self.run_in_worker(operator.add, 2, 3), 5)
+        pid = WORKERS[sys.executable].process.pid
+        self.assertEqual(self.run_in_worker(divmod, 7, 2), (3, 1))
+        self.assertEqual(WORKERS[sys.executable].process.pid, pid)
+
+    def test_exceptions_are_raised_in_the_caller(self):
+        with self.assertRaises(ValueError):
+            self.run_in_worker(int, "x")
+        self.assertEqual(self.run_in_worker(int, "3"), 3)
+
+    def test_dead_worker_is_replaced(self):
+        self.assertEqual(self.run_in_worker(operator.add, 1, 1), 2)
+        worker = WORKERS[sys.executable]
+        with self.assertRaisesRegex(RuntimeError, "exited with code 3"):
+            self.run_in_worker(sys.exit, 3)
+        self.assertEqual(self.run_in_worker(operator.add, 2, 2), 4)
+        self.assertIsNot(WORKERS[sys.executable], worker)
+        self.assertFalse(worker.socket_path.parent.exists())
+
+    def test_close_removes_socket_directory(self):
+        self.run_in_worker(operator.add, 1, 1)
+        socket_dir = WORKERS[sys.executable].socket_path.parent
+        close_workers()
+        self.assertEqual(WORKERS, {})
+        self.assertFalse(socket_dir.exists())
@@ -0,0 +1,206 @@
+"""
+Tests for the slurm options and array submission.
+"""
+
+import os
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from runwith.runners.slurm import (
+    JobGroup,
+    SlurmOptions,
+    SlurmRunner,
+    _validated_slurm,
+    expand_job_id,
+    make_slurm,
+    wait_for_jobs,
+)
+
+
+def noop():
+    pass
+
+
+class TestSlurmOptions(unittest.TestCase):
+    def test_has_no_instance_dict(self):
+        options = SlurmOptions()
+        self.assertFalse(hasattr(options, "__dict__"))
+        with self.assertRaises(AttributeError):
+            options.not_an_option = 1
+
+    def test_equality_and_repr_are_kept(self):
+        self.assertEqual(SlurmOptions(mem="1G"), SlurmOptions(mem="1G"))
+        self.assertIn("mem='1G'", repr(SlurmOptions(mem="1G")))
+
+    def test_to_dict_skips_unset_options(self):
+        self.assertEqual(SlurmOptions(mem="1G").to_dict()["mem"], "1G")
+        self.assertNotIn("partition", SlurmOptions(mem="1G").to_dict())
+
+    def test_to_dict_cache_is_invalidated(self):
+        options = SlurmOptions(mem="1G")
+        self.assertEqual(options.to_dict()["mem"], "1G")
+        options.mem = "2G"
+        options.partition = "short"
+        self.assertEqual(options.to_dict()["mem"], "2G")
+        self.assertEqual(options.to_dict()["partition"], "short")
+
+    def test_to_dict_returns_copies(self):
+        options = SlurmOptions(mem="1G")
+        options.to_dict()["mem"] = "2G"
+        self.assertEqual(options.to_dict()["mem"], "1G")
+
+
+class TestMakeSlurm(unittest.TestCase):
+    def test_job_names_share_one_validated_instance(self):
+        _validated_slurm.cache_clear()
+        first = make_slurm({"mem": "1G", "job_name": "first"})
+        second = make_slurm({"mem": "1G", "job_name": "second"})
+        self.assertEqual(_validated_slurm.cache_info().currsize, 1)
+        self.assertIn("first", str(first))
+        self.assertNotIn("first", str(second))
+        self.assertIn("second", str(second))
+
+    def test_copies_are_independent(self):
+        first = make_slurm({"mem": "1G"})
+        first.add_arguments(mem="2G")
+        self.assertEqual(make_slurm({"mem": "1G"}).namespace.mem, "1G")
+
+
+class TestSlurmRunner(unittest.TestCase):
+    def test_each_step_runs_only_its_own_script(self):
+        runner = SlurmRunner(noop, (), {}, "python {target}", SlurmOptions(mem="1G"), False)
+        with mock.patch("subprocess.run") as run:
+            runner.execute(SimpleNamespace(exec=Path("/jobs/first.sh")))
+            runner.execute(SimpleNamespace(exec=Path("/jobs/second.sh")))
+        commands = [call.args[0] for call in run.call_args_list]
+        self.assertIn("/jobs/first.sh", commands[0])
+        self.assertIn("/jobs/second.sh", commands[1])
+        self.assertNotIn("/jobs/first.sh", commands[1])
+
+
+class TestExpandJobId(unittest.TestCase):
+    def test_single_task(self):
+        self.assertEqual(expand_job_id("12_3"), ["12_3"])
+
+    def test_task_ranges(self):
+        self.assertEqual(expand_job_id("12_[0-2,5%2]"), ["12_0", "12_1", "12_2", "12_5"])
+        self.assertEqual(expand_job_id("12_[0-6:3]"), ["12_0", "12_3", "12_6"])
+
+
+class TestWaitForJobs(unittest.TestCase):
+    def sacct(self, *outputs: str):
+        outputs_iter = iter(outputs)
+        return mock.patch("sh.Command", return_value=lambda *args: next(outputs_iter))
+
+    def test_ranged_records_finish_their_tasks(self):
+        with self.sacct("12_0|COMPLETED\n12_[1-2]|PENDING\n", "12_[1-2]|CANCELLED by 5\n"):
+            states = wait_for_jobs(["12_0", "12_1", "12_2"], poll_interval=0)
+        self.assertEqual(states, {"12_0": "COMPLETED", "12_1": "CANCELLED", "12_2": "CANCELLED"})
+
+    def test_timeout(self):
+        with mock.patch("sh.Command", return_value=lambda *args: "12_0|RUNNING\n"):
+            with self.assertRaises(TimeoutError):
+                wait_for_jobs(["12_0"], poll_interval=0.01, timeout=0.05)
+
+
+class TestSubmitArrays(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.submitted: list[dict] = []
+        self.fail_at: int = -1
+        patcher = mock.patch("runwith.runners.slurm.make_slurm", side_effect=self.make_slurm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def make_slurm(self, options):
+        def sbatch(command):
+            if len(self.submitted) == self.fail_at:
+                raise AssertionError("sbatch failed")
+            self.submitted.append({"options": options, "command": command})
+            return 100 + len(self.submitted) - 1
+
+        return SimpleNamespace(sbatch=sbatch)
+
+    def job(self, index: int, partition: str) -> SlurmRunner:
+        options = SlurmOptions(partition=partition, job_name=f"job{index}")
+        job = SlurmRunner(noop, (), {}, "python {target}", options, verbose=False)
+        job.prepare = mock.Mock(return_value=mock.Mock(exec=Path(f"/jobs/{index}.sh")))
+        return job
+
+    def group(self, partitions: list[str]) -> JobGroup:
+        group = JobGroup(max_array_size=2, max_concurrent=3)
+        for i, partition in enumerate(partitions):
+            group.add_job(self.job(i, partition))
+        return group
+
+    def test_groups_by_options_in_chunks(self):
+        group = self.group(["a", "b", "a", "a"])
+
+        submitted, group_dirs = group._submit_arrays()  # pylint: disable=protected-access
+
+        self.assertEqual([job_id for job_id, _ in submitted], ["100_0", "102_0", "100_1", "101_0"])
+        self.assertEqual(
+            [assets.exec for _, assets in submitted], [Path(f"/jobs/{i}.sh") for i in range(4)]
+        )
+        arrays = [s["options"]["array"] for s in self.submitted]
+        self.assertEqual(arrays, ["0-1%3", "0-0%3", "0-0%3"])
+        self.assertEqual([s["options"]["partition"] for s in self.submitted], ["a", "a", "b"])
+        self.assertEqual(
+            (group_dirs[0] / "manifest.txt").read_text().splitlines(),
+            ["/jobs/0.sh", "/jobs/2.sh"],
+        )
+        self.assertIn(str(group_dirs[0] / "array.sh"), self.submitted[0]["command"])
+
+    def test_array_wrapper_quotes_manifest(self):
+        workdir = Path(self.tmp.name, "$HOME `true` dir")
+        workdir.mkdir()
+        os.chdir(workdir)
+        script = workdir / "job.sh"
+        script.write_text("echo ran\n")
+        group = self.group(["a"])
+        group.jobs[0].prepare.return_value.exec = script
+
+        _, group_dirs = group._submit_arrays()  # pylint: disable=protected-access
+
+        output = subprocess.run(
+            ["bash", str(group_dirs[0] / "array.sh")],
+            env={**os.environ, "SLURM_ARRAY_TASK_ID": "0"},
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        self.assertEqual(output.stdout, "ran\n")
+
+    def test_failed_submission_cancels_and_cleans_up(self):
+        group = self.group(["a", "b", "a", "a"])
+        self.fail_at = 1
+
+        with mock.patch("sh.Command") as command:
+            with self.assertRaises(AssertionError):
+                group.submit_all()
+
+        command.assert_called_once_with("scancel")
+        command.return_value.assert_called_once_with("100")
+        for job in group.jobs:
+            job.prepare.return_value.cleanup.assert_called_once_with()
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_failed_prepare_cleans_up_prepared_jobs(self):
+        group = self.group(["a", "a"])
+        group.jobs[1].prepare.side_effect = TypeError("cannot pickle")
+
+        with self.assertRaises(TypeError):
+            group.run_all(poll_interval=0)
+
+        self.assertEqual(self.submitted, [])
+        group.jobs[0].prepare.return_value.cleanup.assert_called_once_with()